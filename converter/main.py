@@ -9,24 +9,35 @@ Added fields per feature:
   title_en - English name (taken from tags, or falls back to 'name')
 
 Output:
-  output/shp/<year>/countries_<year>.shp
+  output/shp/<year>/countries_<year>.shp   (or .fgb with --driver FlatGeobuf)
 
 Usage:
   uv run main.py                        # all years (1900-2026)
   uv run main.py --start 1950 --end 2000
+  uv run main.py --workers 4            # limit parallel worker processes
+  uv run main.py --driver FlatGeobuf    # single-file .fgb output, faster to write
 """
 
 import argparse
+import functools
 import json
-import re
+import os
+import threading
 import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import repeat
 from pathlib import Path
-from typing import Optional
+from types import SimpleNamespace
+from typing import Iterable, Optional, Sequence
 
+import deep_translator.google
 import geopandas as gpd
-import pandas as pd
+import orjson
+import pyogrio
+import requests
 import zhconv
 from deep_translator import GoogleTranslator
+from requests.adapters import HTTPAdapter
 
 # ---------------------------------------------------------------------------
 # Paths (relative to this script's location)
@@ -35,19 +46,32 @@ from deep_translator import GoogleTranslator
 _HERE = Path(__file__).parent
 INPUT_DIR  = _HERE.parent / "output"
 OUTPUT_DIR = _HERE.parent / "output" / "shp"
+CACHE_FILE = _HERE / "translation_cache.json"
 
 DEFAULT_START = 1900
 DEFAULT_END   = 2026
 
+# Supported output drivers → file extension.  FlatGeobuf writes a single
+# file per year (no .shx/.dbf/.prj/.cpg sidecars) and is faster to write.
+DRIVERS = {
+    "ESRI Shapefile": ".shp",
+    "FlatGeobuf":     ".fgb",
+}
+DEFAULT_DRIVER = "ESRI Shapefile"
+
 # ---------------------------------------------------------------------------
 # Helpers: Chinese character detection
 # ---------------------------------------------------------------------------
 
-# CJK Unified Ideographs + Extension A
-_CJK_RE = re.compile(r"[\u4e00-\u9fff\u3400-\u4dbf]")
+# CJK Unified Ideographs + Extension A.  A set-membership test runs entirely
+# in C and beats re.search on the short strings this script checks.
+_CJK_CHARS = frozenset(
+    chr(c) for lo, hi in ((0x4E00, 0x9FFF), (0x3400, 0x4DBF))
+    for c in range(lo, hi + 1)
+)
 
 def has_chinese(text: Optional[str]) -> bool:
-    return bool(_CJK_RE.search(text or ""))
+    return bool(text) and not _CJK_CHARS.isdisjoint(text)
 
 
 def to_simplified(text: Optional[str]) -> Optional[str]:
@@ -69,13 +93,40 @@ def parse_tags(raw) -> dict:
     if isinstance(raw, dict):
         return raw
     if isinstance(raw, str):
-        try:
-            return json.loads(raw)
-        except (json.JSONDecodeError, ValueError):
-            return {}
+        return _parse_tags_str(raw)
     return {}
 
 
+@functools.lru_cache(maxsize=8192)
+def _parse_tags_str(raw: str) -> dict:
+    """
+    Memoised JSON parse for parse_tags(): the same tag blob recurs across
+    years.  The cached dict is shared between callers, so treat it as
+    read-only.
+    """
+    try:
+        return orjson.loads(raw)
+    except orjson.JSONDecodeError:
+        return {}
+
+
+def tags_and_names(gdf: gpd.GeoDataFrame) -> tuple[list[dict], Sequence[str]]:
+    """
+    Return the parsed tags and the 'name' column (None/NaN → "") as plain
+    per-row sequences.  Zipping over these avoids the per-row overhead of
+    iterrows()/Series.apply() and of str(row.get("name") or "") per row.
+    """
+    tags = (
+        [parse_tags(raw) for raw in gdf["tags"].to_numpy()]
+        if "tags" in gdf.columns else [{}] * len(gdf)
+    )
+    names = (
+        gdf["name"].fillna("").astype(str).to_numpy() if "name" in gdf.columns
+        else [""] * len(gdf)
+    )
+    return tags, names
+
+
 def get_title_en(tags: dict, name: str) -> str:
     """
     English name:
@@ -85,6 +136,11 @@ def get_title_en(tags: dict, name: str) -> str:
     return (tags.get("name:en") or name or "").strip()
 
 
+# Chinese-name tags in priority order (see get_title_zh).
+_ZH_KEYS = ("name:zh-Hans", "name:zh-CN", "name:zh",
+            "name:zh-Hant", "name:zh-TW", "name:zh-SG")
+
+
 def get_title_zh(tags: dict, name: str) -> Optional[str]:
     """
     Return a Simplified Chinese name from tags, or None if not present.
@@ -98,111 +154,218 @@ def get_title_zh(tags: dict, name: str) -> Optional[str]:
       6. name:zh-SG    — Singapore, usually Simplified but convert anyway
       7. name field itself, if it contains CJK characters → convert
     """
-    for key in ("name:zh-Hans", "name:zh-CN", "name:zh",
-                "name:zh-Hant", "name:zh-TW", "name:zh-SG"):
-        val = (tags.get(key) or "").strip()
-        if val:
+    for key in _ZH_KEYS:
+        val = tags.get(key)
+        # Most keys are absent; only strip when there is something to strip.
+        if val and (val := val.strip()):
             return to_simplified(val)
     if has_chinese(name):
         return to_simplified(name.strip())
     return None
 
+# ---------------------------------------------------------------------------
+# Per-year scanning (Phase 1)
+# ---------------------------------------------------------------------------
+
+def find_inputs(start: int, end: int) -> dict[int, Path]:
+    """
+    Map year → GeoJSON path for every countries_<year>.geojson in INPUT_DIR
+    with start <= year <= end.  One directory listing replaces a stat call
+    per year in the range.
+    """
+    found: dict[int, Path] = {}
+    for src in INPUT_DIR.glob("countries_*.geojson"):
+        try:
+            year = int(src.stem.removeprefix("countries_"))
+        except ValueError:
+            continue
+        if start <= year <= end:
+            found[year] = src
+    return dict(sorted(found.items()))
+
+
+def scan_year(src: Path) -> tuple[gpd.GeoDataFrame, set[str]]:
+    """
+    Read one year's GeoJSON and collect the English names of features that
+    have no Chinese name.  Returns (gdf, names).  Only the properties Phase 3
+    needs are read, which skips decoding the rest and keeps the frame pickled
+    back from the worker small.
+    """
+    # Geometry is still read: the frame is reused by Phase 3 for writing.
+    gdf = gpd.read_file(src, engine="pyogrio", columns=["name", "tags"])
+    names: set[str] = set()
+    for tags, name in zip(*tags_and_names(gdf)):
+        if not get_title_zh(tags, name):
+            en = get_title_en(tags, name)
+            # A CJK "English" name is already usable as the title.
+            if en and not has_chinese(en):
+                names.add(en)
+
+    return gdf, names
+
 # ---------------------------------------------------------------------------
 # Translation (batched, with a global cross-year cache)
 # ---------------------------------------------------------------------------
 
 _cache: dict[str, str] = {}
+_cache_lock = threading.Lock()
+
+# deep-translator recommends batches ≤50 to stay within the free-tier
+# character limit (~5 000 chars per request).
+TRANSLATE_BATCH   = 50
+# Batches in flight at once; kept small to stay polite to the free endpoint.
+TRANSLATE_WORKERS = 4
+
+# GoogleTranslator issues a bare requests.get() per name, paying a fresh TCP +
+# TLS handshake every time.  Route those calls through one pooled Session so
+# connections are kept alive and shared by the translation threads.
+_session = requests.Session()
+_session.mount("https://", HTTPAdapter(pool_connections=TRANSLATE_WORKERS,
+                                       pool_maxsize=TRANSLATE_WORKERS))
+deep_translator.google.requests = SimpleNamespace(get=_session.get)
+
+
+def load_translation_cache() -> None:
+    """Populate _cache from CACHE_FILE, if a previous run left one behind."""
+    if not CACHE_FILE.exists():
+        return
+    try:
+        _cache.update(json.loads(CACHE_FILE.read_text(encoding="utf-8")))
+    except (OSError, ValueError) as exc:
+        print(f"  Could not read {CACHE_FILE.name} ({exc}); starting empty.")
 
 
-def prime_translation_cache(names: list[str]) -> None:
+def save_translation_cache() -> None:
     """
-    Collect all unique untranslated English names, translate them in batches,
-    and populate _cache.  Call this once before processing any shapefiles so
-    every year benefits from the same cache without redundant API calls.
+    Write _cache to CACHE_FILE so later runs skip names already translated.
+    Entries where translation fell back to the English source are left out,
+    so failed lookups are retried next time rather than remembered.
     """
-    # Deduplicate while preserving order
-    unique = list(dict.fromkeys(n for n in names if n and n not in _cache))
-    if not unique:
-        print("  All Chinese names found in tags — no translation needed.")
-        return
+    known = {src: tgt for src, tgt in _cache.items() if tgt != src}
+    tmp = CACHE_FILE.with_suffix(".tmp")
+    tmp.write_text(json.dumps(known, ensure_ascii=False, indent=1),
+                   encoding="utf-8")
+    tmp.replace(CACHE_FILE)
 
-    print(f"\nTranslating {len(unique)} unique name(s) to Chinese "
-          f"(Google Translate, free tier)...")
 
-    translator = GoogleTranslator(source="auto", target="zh-CN")
+def _init_worker(cache: dict[str, str]) -> None:
+    """ProcessPoolExecutor initializer: hand each worker the primed cache."""
+    _cache.update(cache)
 
-    # deep-translator recommends batches ≤50 to stay within the free-tier
-    # character limit (~5 000 chars per request).
-    BATCH = 50
-    for i in range(0, len(unique), BATCH):
-        chunk = unique[i : i + BATCH]
-        try:
-            results = translator.translate_batch(chunk)
+
+def _translate_chunk(chunk: list[str]) -> None:
+    """Translate one batch into _cache; runs on a ThreadPoolExecutor thread."""
+    # GoogleTranslator keeps per-request state on the instance, so each
+    # thread needs its own rather than sharing one.
+    translator = GoogleTranslator(source="auto", target="zh-CN")
+    try:
+        results = translator.translate_batch(chunk)
+        with _cache_lock:
             for src, tgt in zip(chunk, results):
                 _cache[src] = tgt or src
-            time.sleep(0.5)          # polite delay between requests
-        except Exception as exc:
-            print(f"  Batch translation failed ({exc}); retrying one-by-one …")
-            for src in chunk:
-                try:
-                    _cache[src] = translator.translate(src) or src
-                    time.sleep(0.2)
-                except Exception as e2:
-                    print(f"  Could not translate '{src}': {e2}")
-                    _cache[src] = src     # keep English as fallback
-
-    print("  Translation complete.")
+        time.sleep(0.5)          # polite delay between requests
+    except Exception as exc:
+        print(f"  Batch translation failed ({exc}); retrying one-by-one …")
+        for src in chunk:
+            try:
+                tgt = translator.translate(src) or src
+                time.sleep(0.2)
+            except Exception as e2:
+                print(f"  Could not translate '{src}': {e2}")
+                tgt = src             # keep English as fallback
+            with _cache_lock:
+                _cache[src] = tgt
+
+
+def prime_translation_cache(name_sets: Iterable[set[str]]) -> None:
+    """
+    Translate every unique untranslated English name and populate _cache.
+
+    *name_sets* is consumed lazily (e.g. one set per scanned year) and each
+    full batch is handed to the TRANSLATE_WORKERS thread pool as soon as it
+    fills up, so translation overlaps with the scan that produces the names.
+    Call this once before processing any shapefiles so every year benefits
+    from the same cache without redundant API calls.
+    """
+    seen: set[str] = set()
+    pending: list[str] = []
+    futures = []
+    submitted = 0
+    with ThreadPoolExecutor(max_workers=TRANSLATE_WORKERS) as ex:
+        for names in name_sets:
+            # sort so batches are reproducible
+            for name in sorted(names - seen):
+                seen.add(name)
+                if name and name not in _cache:
+                    pending.append(name)
+                    submitted += 1
+                if len(pending) == TRANSLATE_BATCH:
+                    futures.append(ex.submit(_translate_chunk, pending))
+                    pending = []
+        if pending:
+            futures.append(ex.submit(_translate_chunk, pending))
+        # result() re-raises any unexpected exception from a worker thread.
+        for future in futures:
+            future.result()
+
+    if not submitted:
+        print("  All names have Chinese tags or are cached — "
+              "no translation needed.")
+        return
+    print(f"  Translated {submitted} unique name(s) to Chinese "
+          f"(Google Translate, free tier).")
 
 # ---------------------------------------------------------------------------
 # Per-year shapefile generation
 # ---------------------------------------------------------------------------
 
-def process_year(year: int) -> bool:
-    src     = INPUT_DIR / f"countries_{year}.geojson"
+def process_year(year: int, gdf: Optional[gpd.GeoDataFrame],
+                 driver: str = DEFAULT_DRIVER) -> bool:
+    """
+    Write the shapefile (or other *driver* output, see DRIVERS) for *year*
+    from the GeoDataFrame already parsed in Phase 1.  *gdf* is None when the
+    year's GeoJSON was not found.
+    """
     dst_dir = OUTPUT_DIR / str(year)
-    dst     = dst_dir / f"countries_{year}.shp"
+    dst     = dst_dir / f"countries_{year}{DRIVERS[driver]}"
 
-    if not src.exists():
-        print(f"[{year}] {src.name} not found, skipping.")
+    if gdf is None:
+        print(f"[{year}] countries_{year}.geojson not found, skipping.")
         return False
 
     dst_dir.mkdir(parents=True, exist_ok=True)
 
-    gdf = gpd.read_file(src)
+    # Work on a fresh frame so the cached Phase-1 frame is left untouched.
+    gdf = gdf.reset_index(drop=True)
 
-    # -- parse tags column --------------------------------------------------
-    tags_series = (
-        gdf["tags"].apply(parse_tags) if "tags" in gdf.columns
-        else pd.Series([{}] * len(gdf))
-    )
+    # -- parse tags / name columns ------------------------------------------
+    tags_arr, names = tags_and_names(gdf)
 
     # -- title_en -----------------------------------------------------------
-    gdf["title_en"] = [
-        get_title_en(tags, str(row.get("name") or ""))
-        for tags, (_, row) in zip(tags_series, gdf.iterrows())
-    ]
+    titles_en = [get_title_en(tags, name) for tags, name in zip(tags_arr, names)]
+    gdf["title_en"] = titles_en
 
     # -- title (Chinese) ----------------------------------------------------
     # Use a pre-populated tag value when available; otherwise look up _cache.
     titles = []
-    for tags, (_, row) in zip(tags_series, gdf.iterrows()):
-        zh = get_title_zh(tags, str(row.get("name") or ""))
+    for tags, name, en in zip(tags_arr, names, titles_en):
+        zh = get_title_zh(tags, name)
         if zh:
             titles.append(zh)
         else:
-            en = row["title_en"]
             # Google Translate targets zh-CN (already Simplified), but run
             # through zhconv anyway for consistency.
             titles.append(to_simplified(_cache.get(en, en)))
     gdf["title"] = titles
 
     # -- oid ----------------------------------------------------------------
-    gdf = gdf.reset_index(drop=True)
     gdf["oid"] = gdf.index + 1
 
     # -- write shapefile (UTF-8 for Chinese characters) ---------------------
-    out = gdf[["oid", "title", "title_en", "geometry"]].copy()
-    out.to_file(dst, driver="ESRI Shapefile", encoding="utf-8")
+    # Column selection already yields a new frame; no extra .copy() needed.
+    out = gdf[["oid", "title", "title_en", "geometry"]]
+    # pyogrio directly: skips geopandas' to_file() dispatch layer.
+    pyogrio.write_dataframe(out, dst, driver=driver, encoding="UTF-8")
 
     print(f"[{year}] {len(out):>3} features → {dst.relative_to(_HERE.parent)}")
     return True
@@ -220,47 +383,63 @@ def main() -> None:
                         metavar="YEAR", help="First year to process (default: 1900)")
     parser.add_argument("--end",   type=int, default=DEFAULT_END,
                         metavar="YEAR", help="Last year to process  (default: 2026)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                        metavar="N", help="Parallel worker processes "
+                                          "(default: CPU count)")
+    parser.add_argument("--driver", choices=DRIVERS, default=DEFAULT_DRIVER,
+                        help="Output format (default: ESRI Shapefile; "
+                             "FlatGeobuf writes one .fgb file per year)")
     args = parser.parse_args()
 
     if args.start > args.end:
         print(f"Error: --start ({args.start}) must be <= --end ({args.end})")
         raise SystemExit(1)
+    if args.workers < 1:
+        print(f"Error: --workers ({args.workers}) must be >= 1")
+        raise SystemExit(1)
 
     years = list(range(args.start, args.end + 1))
+    inputs = find_inputs(args.start, args.end)
 
     # -----------------------------------------------------------------------
-    # Phase 1 — scan every GeoJSON to find names that need translation
+    # Phases 1 + 2 — scan every GeoJSON for names without a Chinese tag and
+    # batch-translate them; batches are sent while later years are scanned
     # -----------------------------------------------------------------------
-    print(f"Phase 1: scanning {len(years)} GeoJSON file(s) for "
+    print(f"Phase 1: scanning {len(inputs)} GeoJSON file(s) for "
           f"names without a Chinese tag …")
+    print(f"Phase 2: translating as names are found …")
+    load_translation_cache()
 
-    needs_translation: list[str] = []
-    for year in years:
-        src = INPUT_DIR / f"countries_{year}.geojson"
-        if not src.exists():
-            continue
-        gdf = gpd.read_file(src)
-        for _, row in gdf.iterrows():
-            tags = parse_tags(row.get("tags"))
-            if not get_title_zh(tags, str(row.get("name") or "")):
-                en = get_title_en(tags, str(row.get("name") or ""))
-                if en:
-                    needs_translation.append(en)
+    # Parsed frames are kept for Phase 3 so each GeoJSON is only read once.
+    gdfs: dict[int, gpd.GeoDataFrame] = {}
 
-    # -----------------------------------------------------------------------
-    # Phase 2 — batch-translate all missing names (one API round-trip set)
-    # -----------------------------------------------------------------------
-    print(f"Phase 2: translating …")
-    prime_translation_cache(needs_translation)
+    def scanned(ex: ProcessPoolExecutor) -> Iterable[set[str]]:
+        for year, (gdf, names) in zip(inputs, ex.map(scan_year,
+                                                      inputs.values())):
+            gdfs[year] = gdf
+            yield names
+
+    try:
+        with ProcessPoolExecutor(max_workers=args.workers) as ex:
+            prime_translation_cache(scanned(ex))
+    finally:
+        # Keep whatever was translated, even if the run is interrupted.
+        save_translation_cache()
 
     # -----------------------------------------------------------------------
     # Phase 3 — write one shapefile per year
     # -----------------------------------------------------------------------
-    print(f"\nPhase 3: writing shapefiles …\n")
+    print(f"\nPhase 3: writing {args.driver} files …\n")
     OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
 
-    written = sum(process_year(y) for y in years)
-    print(f"\nDone — {written}/{len(years)} shapefile(s) written to {OUTPUT_DIR}/")
+    # Each worker receives a copy of the primed translation cache up front.
+    with ProcessPoolExecutor(max_workers=args.workers,
+                             initializer=_init_worker,
+                             initargs=(_cache,)) as ex:
+        written = sum(ex.map(process_year, years,
+                             [gdfs.get(y) for y in years],
+                             repeat(args.driver)))
+    print(f"\nDone — {written}/{len(years)} file(s) written to {OUTPUT_DIR}/")
 
 
 if __name__ == "__main__":